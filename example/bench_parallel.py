@@ -1,106 +1,634 @@
 """Simple XRD Pattern Calculator - Rust vs Python Comparison (Parallel)"""
 
 from pathlib import Path
+import argparse
+import os
+import sys
 import time
-import csv
-from pymatgen.core import Structure
+import queue
+import threading
+from pymatgen.core import Lattice, Structure
 from pymatgen.analysis.diffraction.xrd import XRDCalculator
 from xrd_rust_calculator import XRDCalculatorRust
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from collections import defaultdict
+import heapq
 import multiprocessing as mp
-from threading import Lock
+from multiprocessing import shared_memory
+
+try:
+    import gemmi
+    HAS_GEMMI = True
+except ImportError:
+    HAS_GEMMI = False
+
+try:
+    from mpire import WorkerPool
+    HAS_MPIRE = True
+except ImportError:
+    HAS_MPIRE = False
+
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 WAVELENGTH = "MoKa"
 TWO_THETA_MIN = 2
 TWO_THETA_MAX = 60
-NUM_WORKERS = 14  # Number of parallel processes
+NUM_WORKERS = None  # Number of parallel processes (None = one per physical core)
+PYTHON_MAX_SITES = 200  # Larger structures skip the pymatgen baseline (None = never skip)
+PREFETCH_DEPTH = 2  # Files each worker reads ahead of the one being computed
+TOP_SPEEDUPS = 5  # Number of best speedups listed in the final summary
+ARROW_BATCH_ROWS = 1024  # Rows per record batch in the Arrow summary file
+SITE_DECIMALS = 4  # Fractional coordinates equal to this many decimals are one site
+CHUNK_MAX_FILES = 32  # Upper bound on files per chunk, so at most 2 * NUM_WORKERS * 32 are in flight
+SHM_MAX_BYTES = 32 * 1024 * 1024  # Shared memory in use before --shm stops submitting chunks
 
-# Lock for thread-safe CSV writing
-csv_lock = Lock()
+STRUCTURE_SUFFIXES = (".cif", ".CIF")
+STRUCTURE_PREFIXES = ("POSCAR", "CONTCAR")
 
-def process_single_file(filepath, structures_dir):
-    """Process a single structure file and return results"""
-    relative_path = filepath.relative_to(structures_dir)
+
+def iter_structures(root):
+    """Yield structure files below root in a single directory traversal
+
+    Unreadable directories are skipped, as Path.rglob does.
+    """
+    try:
+        entries = os.scandir(root)
+    except PermissionError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_structures(entry.path)
+            else:
+                name = entry.name
+                if name.endswith(STRUCTURE_SUFFIXES) or name.startswith(STRUCTURE_PREFIXES):
+                    yield Path(entry.path)
+
+
+def physical_cpu_ids():
+    """Return one usable logical CPU id per physical core (Linux only)"""
+    if not hasattr(os, "sched_getaffinity"):
+        return []
+    cpu_ids = []
+    seen_cores = set()
+    for cpu in sorted(os.sched_getaffinity(0)):
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                core = f.read().strip()
+        except OSError:
+            core = str(cpu)
+        if core not in seen_cores:
+            seen_cores.add(core)
+            cpu_ids.append(cpu)
+    return cpu_ids
+
+
+def default_num_workers():
+    """One worker per physical core, so SMT siblings do not share the SIMD units"""
+    count = len(physical_cpu_ids())
+    if not count:
+        try:
+            import psutil
+            count = psutil.cpu_count(logical=False)
+        except ImportError:
+            count = None
+    return count or os.cpu_count() or 1
+
+
+def _is_cif(filepath):
+    return filepath.suffix.lower() == ".cif"
+
+
+def parse_fast(filepath, data=None):
+    """Load a structure, reading CIFs with gemmi when it is installed
+
+    The XRD calculators only need the lattice and the occupied unit-cell
+    sites, so pymatgen's CifParser (symmetry checks, oxidation-state
+    guessing, validation) is skipped. POSCAR/CONTCAR files and CIFs that
+    gemmi cannot read fall back to pymatgen. If data (the raw contents of
+    a CIF) is given, the file is not read again.
+    """
+    is_cif = _is_cif(filepath)
+    text = None if data is None or not is_cif else data.decode("utf-8", errors="replace")
+
+    if HAS_GEMMI and is_cif:
+        try:
+            if text is None:
+                small = gemmi.read_small_structure(str(filepath))
+            else:
+                small = gemmi.make_small_structure_from_block(gemmi.cif.read_string(text).sole_block())
+            cell = small.cell
+            lattice = Lattice.from_parameters(cell.a, cell.b, cell.c,
+                                              cell.alpha, cell.beta, cell.gamma)
+            # Symmetry images are expanded here rather than with
+            # get_all_unit_cell_sites, which merges images closer than ~0.4 Å
+            # and so drops atoms of split (disordered) sites. Only images at
+            # the same position to SITE_DECIMALS are merged, as in pymatgen;
+            # different atoms sharing a position (e.g. Fe0.5/Co0.5) become
+            # one site with a composite species.
+            positions = {}
+            for index, site in enumerate(small.sites):
+                for fract in [site.fract] + [image.apply(site.fract) for image in cell.images]:
+                    coords = (fract.x % 1.0, fract.y % 1.0, fract.z % 1.0)
+                    key = tuple(round(x, SITE_DECIMALS) % 1.0 for x in coords)
+                    _, species, added = positions.setdefault(key, (coords, {}, set()))
+                    if index not in added:
+                        added.add(index)
+                        species[site.element.name] = species.get(site.element.name, 0.0) + site.occ
+            if positions:
+                return Structure(
+                    lattice,
+                    [species for _, species, _ in positions.values()],
+                    [coords for coords, _, _ in positions.values()],
+                )
+        except (RuntimeError, ValueError):
+            pass
+
+    # POSCAR/CONTCAR files may be compressed or take their species from a
+    # neighbouring POTCAR, which only Structure.from_file handles
+    if text is None:
+        return Structure.from_file(filepath)
+    return Structure.from_str(text, fmt="cif")
+
+
+# Set once per worker process by _init_worker
+_STRUCT_DIR = None
+_CALC_RUST = None
+_CALC_PYTHON = None  # None when the Python baseline is skipped
+_COUNT_ONLY = False
+_BATCH = False
+
+
+def _init_worker(structures_dir, wavelength, rust_only=False, count_only=False, batch=False,
+                 cpu_ids=None, worker_counter=None):
+    """Store shared arguments and build the calculators once per worker process"""
+    global _STRUCT_DIR, _CALC_RUST, _CALC_PYTHON, _COUNT_ONLY, _BATCH
+    _STRUCT_DIR = structures_dir
+    _COUNT_ONLY = count_only
+    _BATCH = batch
+    _CALC_RUST = XRDCalculatorRust(wavelength=wavelength)
+    _CALC_PYTHON = None if rust_only else XRDCalculator(wavelength=wavelength)
+
+    if cpu_ids:
+        with worker_counter.get_lock():
+            worker_index = worker_counter.value
+            worker_counter.value += 1
+        os.sched_setaffinity(0, {cpu_ids[worker_index % len(cpu_ids)]})
+
+
+def _file_size(filepath):
+    """Size used for scheduling; unreadable files sort last and fail in their worker"""
+    try:
+        return filepath.stat().st_size
+    except OSError:
+        return 0
+
+
+def _subfolder(filepath):
+    relative_path = filepath.relative_to(_STRUCT_DIR)
     
     if len(relative_path.parts) > 1:
-        subfolder = str(Path(*relative_path.parts[:-1]))
-    else:
-        subfolder = "root"
+        return str(Path(*relative_path.parts[:-1]))
+    return "root"
+
+
+def _read_task(task):
+    """Return (filepath, data), copying the file contents out of shared memory if present"""
+    filepath, shared = task
+    if shared is None:
+        return filepath, None
+
+    name, length = shared
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        with shm.buf[:length] as view:
+            return filepath, bytes(view)
+    finally:
+        shm.close()
+
+
+def _load_task(task):
+    """Return (filepath, data) with CIF contents loaded from shared memory or disk"""
+    filepath = task[0]
+    try:
+        filepath, data = _read_task(task)
+        if data is None and _is_cif(filepath):
+            data = filepath.read_bytes()
+    except Exception:
+        # Leave it to the parser to read the file again and report the error
+        data = None
+    return filepath, data
+
+
+def iter_prefetched(tasks):
+    """Yield (filepath, data) for each task while a background thread reads the next ones
+
+    File reads release the GIL, so disk latency overlaps with the
+    parsing and pattern calculation of the previous file.
+    """
+    ready = queue.Queue(maxsize=PREFETCH_DEPTH)
+
+    def reader():
+        for task in tasks:
+            ready.put(_load_task(task))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    for _ in tasks:
+        yield ready.get()
+    thread.join()
+
+
+def _load_timed(filepath, data=None):
+    """Parse a structure; parsing is timed on its own so it is not charged to either calculator"""
+    start = time.perf_counter()
+    structure = parse_fast(filepath, data)
+    return structure, time.perf_counter() - start
+
+
+def _success_result(filepath, subfolder, structure, peaks_rust, time_parse, time_rust,
+                    time_rust_kernel=None):
+    row_data = {
+        'file': filepath.name,
+        'subfolder': subfolder,
+        'formula': structure.composition.reduced_formula,
+        'atoms': structure.num_sites,
+        'peaks_rust': peaks_rust,
+        'peaks_python': None,
+        'time_parse_sec': time_parse,
+        'time_rust_sec': time_rust,
+        'time_rust_kernel_sec': time_rust_kernel,
+        'time_python_sec': None,
+        'speedup': None
+    }
+    return ('success', filepath, subfolder, row_data)
+
+
+def _error_result(filepath, subfolder, error):
+    error_row = {
+        'file': filepath.name,
+        'subfolder': subfolder,
+        'formula': 'ERROR',
+        'atoms': None,
+        'peaks_rust': None,
+        'peaks_python': None,
+        'time_parse_sec': None,
+        'time_rust_sec': None,
+        'time_rust_kernel_sec': None,
+        'time_python_sec': None,
+        'speedup': None
+    }
+    return ('error', filepath, subfolder, error_row, str(error))
+
+
+def process_single_file(filepath, data=None):
+    """Process a single structure file and return results"""
+    subfolder = _subfolder(filepath)
     
     try:
-        structure = Structure.from_file(filepath)
-        formula = structure.composition.reduced_formula
+        structure, time_parse = _load_timed(filepath, data)
         
         # Rust calculation
-        calc_rust = XRDCalculatorRust(wavelength=WAVELENGTH)
+        # The kernel time is measured inside Rust and excludes the PyO3 conversions
+        time_rust_kernel = None
         start = time.perf_counter()
-        pattern_rust = calc_rust.get_pattern(structure, two_theta_range=(TWO_THETA_MIN, TWO_THETA_MAX))
+        if _COUNT_ONLY:
+            peaks_rust = _CALC_RUST.get_pattern_count(structure, two_theta_range=(TWO_THETA_MIN, TWO_THETA_MAX))
+        else:
+            pattern_rust, kernel_ns = _CALC_RUST.get_pattern_timed(structure, two_theta_range=(TWO_THETA_MIN, TWO_THETA_MAX))
+            peaks_rust = len(pattern_rust.x)
+            time_rust_kernel = kernel_ns * 1e-9
         time_rust = time.perf_counter() - start
         
-        # Python calculation
-        calc_python = XRDCalculator(wavelength=WAVELENGTH)
-        start = time.perf_counter()
-        pattern_python = calc_python.get_pattern(structure, two_theta_range=(TWO_THETA_MIN, TWO_THETA_MAX))
-        time_python = time.perf_counter() - start
+        result = _success_result(filepath, subfolder, structure, peaks_rust, time_parse, time_rust,
+                                 time_rust_kernel)
         
-        row_data = {
-            'file': filepath.name,
-            'subfolder': subfolder,
-            'formula': formula,
-            'atoms': structure.num_sites,
-            'peaks_rust': len(pattern_rust.x),
-            'peaks_python': len(pattern_python.x),
-            'time_rust_sec': f"{time_rust:.4f}",
-            'time_python_sec': f"{time_python:.4f}",
-            'speedup': f"{time_python / time_rust:.2f}"
-        }
+        # Python calculation, skipped for structures where pymatgen would dominate the run
+        if _CALC_PYTHON is not None and (PYTHON_MAX_SITES is None
+                                         or structure.num_sites <= PYTHON_MAX_SITES):
+            start = time.perf_counter()
+            pattern_python = _CALC_PYTHON.get_pattern(structure, two_theta_range=(TWO_THETA_MIN, TWO_THETA_MAX))
+            time_python = time.perf_counter() - start
+            
+            row_data = result[3]
+            row_data['peaks_python'] = len(pattern_python.x)
+            row_data['time_python_sec'] = time_python
+            row_data['speedup'] = time_python / time_rust
         
-        return ('success', filepath, subfolder, row_data)
+        return result
         
     except Exception as e:
-        error_row = {
-            'file': filepath.name,
-            'subfolder': subfolder,
-            'formula': 'ERROR',
-            'atoms': 0,
-            'peaks_rust': 0,
-            'peaks_python': 0,
-            'time_rust_sec': 0,
-            'time_python_sec': 0,
-            'speedup': 0
-        }
-        return ('error', filepath, subfolder, error_row, str(e))
+        return _error_result(filepath, subfolder, e)
+
+
+def process_batch(tasks):
+    """Compute all patterns of a chunk with one Rust call (Rust-only mode)
+
+    Individual timings are not available inside a batch, so every file
+    is charged the mean Rust time of its batch.
+    """
+    results = []
+    parsed = []
+    for filepath, data in iter_prefetched(tasks):
+        subfolder = _subfolder(filepath)
+        try:
+            structure, time_parse = _load_timed(filepath, data)
+        except Exception as e:
+            results.append(_error_result(filepath, subfolder, e))
+        else:
+            parsed.append((filepath, subfolder, structure, time_parse))
+
+    if not parsed:
+        return results
+
+    try:
+        start = time.perf_counter()
+        patterns = _CALC_RUST.get_patterns_batch(
+            [structure for _, _, structure, _ in parsed],
+            two_theta_range=(TWO_THETA_MIN, TWO_THETA_MAX),
+            return_exceptions=True,
+        )
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        results.extend(_error_result(filepath, subfolder, e) for filepath, subfolder, _, _ in parsed)
+        return results
+
+    # A structure that fails to prepare (e.g. an element without scattering
+    # data) is reported on its own; the rest of the batch is unaffected
+    time_rust = elapsed / max(1, sum(not isinstance(p, Exception) for p in patterns))
+    for (filepath, subfolder, structure, time_parse), pattern in zip(parsed, patterns):
+        if isinstance(pattern, Exception):
+            results.append(_error_result(filepath, subfolder, pattern))
+        else:
+            results.append(_success_result(filepath, subfolder, structure, len(pattern.x), time_parse, time_rust))
+    return results
+
+
+def process_chunk(tasks):
+    """Process a group of files in one task to amortize dispatch overhead
+
+    Each task is (filepath, shared), where shared is the (name, length)
+    of a shared memory block holding the file, or None to read from disk.
+    """
+    if _BATCH:
+        return process_batch(tasks)
+    return [process_single_file(filepath, data) for filepath, data in iter_prefetched(tasks)]
+
+
+def _share_chunk(filepaths):
+    """Copy the CIFs of a chunk into shared memory blocks owned by the caller"""
+    tasks = []
+    blocks = []
+    for filepath in filepaths:
+        if not _is_cif(filepath):
+            # parse_fast reads POSCAR/CONTCAR files itself
+            tasks.append((filepath, None))
+            continue
+        try:
+            data = filepath.read_bytes()
+        except OSError:
+            # Let the worker hit (and report) the same error
+            tasks.append((filepath, None))
+            continue
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        blocks.append(shm)
+        tasks.append((filepath, (shm.name, len(data))))
+    return tasks, blocks
+
+
+def _release_blocks(blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+def _csv_field(value):
+    text = str(value)
+    if any(c in text for c in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _num(value, spec=""):
+    return "NA" if value is None else format(value, spec)
+
+
+def to_csv_row(row):
+    """Format a result row as one encoded CSV line
+
+    Rows keep their numbers as floats (None where not measured); they
+    are rounded only here. Only the path-derived fields can contain
+    separators; formulas and numbers are written as they are.
+    """
+    return (
+        f"{_csv_field(row['file'])},{_csv_field(row['subfolder'])},{row['formula']},"
+        f"{_num(row['atoms'])},{_num(row['peaks_rust'])},{_num(row['peaks_python'])},"
+        f"{_num(row['time_parse_sec'], '.4f')},{_num(row['time_rust_sec'], '.4f')},"
+        f"{_num(row['time_rust_kernel_sec'], '.6f')},"
+        f"{_num(row['time_python_sec'], '.4f')},{_num(row['speedup'], '.2f')}\n"
+    ).encode()
+
+
+class ArrowRowWriter:
+    """Stream result rows into an Arrow IPC file, one record batch per ARROW_BATCH_ROWS rows
+
+    Numbers are stored with their types (None becomes null), so the
+    results can be reloaded for analysis without parsing any strings.
+    """
+
+    SCHEMA = pa.schema([
+        ('file', pa.string()),
+        ('subfolder', pa.string()),
+        ('formula', pa.string()),
+        ('atoms', pa.int32()),
+        ('peaks_rust', pa.int32()),
+        ('peaks_python', pa.int32()),
+        ('time_parse_sec', pa.float64()),
+        ('time_rust_sec', pa.float64()),
+        ('time_rust_kernel_sec', pa.float64()),
+        ('time_python_sec', pa.float64()),
+        ('speedup', pa.float64()),
+    ]) if HAS_PYARROW else None
+
+    def __init__(self, path):
+        self._writer = pa.ipc.new_file(str(path), self.SCHEMA)
+        self._columns = {name: [] for name in self.SCHEMA.names}
+        self._pending = 0
+
+    def write(self, row):
+        for name, column in self._columns.items():
+            column.append(row[name])
+        self._pending += 1
+        if self._pending >= ARROW_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._writer.write_batch(pa.RecordBatch.from_pydict(self._columns, schema=self.SCHEMA))
+            for column in self._columns.values():
+                column.clear()
+            self._pending = 0
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def iter_results(executor, chunks, max_inflight, share=False):
+    """Yield results as they complete, keeping at most max_inflight chunks submitted
+
+    Chunks hold at most CHUNK_MAX_FILES files, so the number of files in
+    flight does not grow with the dataset.
+
+    With share=True the file contents are sent to the workers through
+    shared memory; each block is unlinked once its chunk has completed.
+    No new chunk is shared while the live blocks exceed SHM_MAX_BYTES, so
+    at most SHM_MAX_BYTES plus one chunk of files sit in shared memory.
+    """
+    chunks = iter(chunks)
+    inflight = {}
+    shared_bytes = 0
+    try:
+        while True:
+            while len(inflight) < max_inflight and not (inflight and shared_bytes > SHM_MAX_BYTES):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                if share:
+                    tasks, blocks = _share_chunk(chunk)
+                    shared_bytes += sum(shm.size for shm in blocks)
+                else:
+                    tasks, blocks = [(filepath, None) for filepath in chunk], []
+                inflight[executor.submit(process_chunk, tasks)] = blocks
+            if not inflight:
+                return
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for future in done:
+                blocks = inflight.pop(future)
+                shared_bytes -= sum(shm.size for shm in blocks)
+                _release_blocks(blocks)
+                yield from future.result()
+    finally:
+        for blocks in inflight.values():
+            _release_blocks(blocks)
+
+
+def iter_results_futures(chunks, num_workers, worker_args, mp_context, cpu_ids=None, share=False):
+    """Run the chunks on a ProcessPoolExecutor, pinning workers through the initializer"""
+    worker_counter = mp_context.Value("i", 0)
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context,
+                             initializer=_init_worker,
+                             initargs=(*worker_args, cpu_ids, worker_counter)) as executor:
+        yield from iter_results(executor, chunks, max_inflight=2 * num_workers, share=share)
+
+
+# mpire passes the shared objects as the first argument of both functions
+def _init_mpire_worker(shared_objects):
+    _init_worker(*shared_objects)
+
+
+def _process_chunk_mpire(shared_objects, tasks):
+    return process_chunk(tasks)
+
+
+def iter_results_mpire(chunks, num_workers, worker_args, mp_context, cpu_ids=None):
+    """Run the chunks on an mpire WorkerPool and print its insights when done
+
+    The worker arguments are passed once as shared objects (inherited
+    without pickling under fork) and pinning is left to mpire's cpu_ids.
+    """
+    if cpu_ids:
+        cpu_ids = [cpu_ids[i % len(cpu_ids)] for i in range(num_workers)]
+    with WorkerPool(n_jobs=num_workers, shared_objects=worker_args, cpu_ids=cpu_ids or None,
+                    start_method=mp_context.get_start_method(), enable_insights=True) as pool:
+        # Each chunk is wrapped in a tuple so mpire passes it as a single argument
+        tasks = (([(filepath, None) for filepath in chunk],) for chunk in chunks)
+        for chunk_results in pool.imap_unordered(_process_chunk_mpire, tasks, worker_init=_init_mpire_worker,
+                                                 chunk_size=1):
+            yield from chunk_results
+        pool.print_insights()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS,
+                        help="number of worker processes (default: one per physical core)")
+    parser.add_argument("--pin", action="store_true",
+                        help="pin each worker to its own physical core (Linux only)")
+    parser.add_argument("--rust-only", action="store_true",
+                        help="time only the Rust calculator and skip the pymatgen baseline")
+    parser.add_argument("--count-only", action="store_true",
+                        help="let the Rust calculator count peaks without assembling the full pattern")
+    parser.add_argument("--batch", action="store_true",
+                        help="compute each chunk with one Rust call (requires --rust-only; "
+                             "files are charged the mean Rust time of their chunk)")
+    parser.add_argument("--shm", action="store_true",
+                        help="read files in the main process and pass them to workers via shared memory")
+    parser.add_argument("--backend", choices=("futures", "mpire"),
+                        default="mpire" if HAS_MPIRE else "futures",
+                        help="process pool implementation (default: mpire when installed)")
+    parser.add_argument("--no-csv", action="store_true",
+                        help="write only the Arrow summary (requires pyarrow)")
+    args = parser.parse_args()
+    if args.no_csv and not HAS_PYARROW:
+        parser.error("--no-csv requires pyarrow for the Arrow summary")
+    if args.backend == "mpire" and not HAS_MPIRE:
+        parser.error("--backend mpire requires the mpire package")
+    if args.backend == "mpire" and args.shm:
+        parser.error("--shm is only supported by the futures backend")
+    if args.batch and not args.rust_only:
+        parser.error("--batch requires --rust-only")
+    if args.batch and args.count_only:
+        parser.error("--batch cannot be combined with --count-only")
+
+    NUM_WORKERS = args.workers or default_num_workers()
+    cpu_ids = physical_cpu_ids() if args.pin else []
+    if args.pin and not cpu_ids:
+        print("CPU pinning is not supported on this platform, running unpinned")
+
     structures_dir = Path(".")
     output_dir = Path("./xrd_results")
     output_dir.mkdir(exist_ok=True)
 
     summary_file = output_dir / "benchmark_summary.csv"
+    arrow_file = summary_file.with_suffix(".arrow")
+    saved_files = ([] if args.no_csv else [summary_file]) + ([arrow_file] if HAS_PYARROW else [])
+    # Do not leave a previous run's summary next to the new one
+    if args.no_csv:
+        summary_file.unlink(missing_ok=True)
+    if not HAS_PYARROW:
+        arrow_file.unlink(missing_ok=True)
     csv_headers = ['file', 'subfolder', 'formula', 'atoms', 'peaks_rust', 'peaks_python', 
-                   'time_rust_sec', 'time_python_sec', 'speedup']
-
-    with open(summary_file, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=csv_headers)
-        writer.writeheader()
+                   'time_parse_sec', 'time_rust_sec', 'time_rust_kernel_sec', 'time_python_sec', 'speedup']
 
     print("Searching for structure files recursively...")
-    structure_files = []
-
-    structure_files.extend(structures_dir.rglob("*.cif"))
-    structure_files.extend(structures_dir.rglob("*.CIF"))
-    structure_files.extend(structures_dir.rglob("POSCAR*"))
-    structure_files.extend(structures_dir.rglob("CONTCAR*"))
-
-    structure_files = sorted(set(structure_files))
+    # Largest files first (longest-processing-time scheduling) so a big
+    # structure never starts last while the other workers sit idle; the
+    # stable sort keeps equal sizes in path order, deterministic between runs
+    structure_files = sorted(iter_structures(structures_dir))
+    structure_files.sort(key=_file_size, reverse=True)
 
     print(f"\n{'='*70}")
     print(f"Found {len(structure_files)} structure files in all subdirectories")
     print(f"Wavelength: {WAVELENGTH}")
     print(f"2θ range: {TWO_THETA_MIN}° - {TWO_THETA_MAX}°")
-    print(f"Parallel workers: {NUM_WORKERS}")
-    print(f"Saving real-time results to: {summary_file}")
+    print(f"Parallel workers: {NUM_WORKERS}{' (pinned)' if cpu_ids else ''} ({args.backend})")
+    if args.rust_only:
+        print("Python baseline: skipped (--rust-only)")
+    elif PYTHON_MAX_SITES is not None:
+        print(f"Python baseline: structures with up to {PYTHON_MAX_SITES} sites")
+    if args.count_only:
+        print("Rust pattern assembly: skipped (--count-only)")
+    if args.batch:
+        print("Rust calls: one per chunk (--batch)")
+    if args.shm:
+        print("File transport: shared memory (--shm)")
+    print(f"Saving real-time results to: {', '.join(map(str, saved_files))}")
     print(f"{'='*70}\n")
 
     subdirs = set()
@@ -113,80 +641,124 @@ if __name__ == '__main__':
     if subdirs:
         print(f"Subdirectories found: {', '.join(sorted(subdirs))}\n")
 
-    results = []
     completed = 0
     total = len(structure_files)
+
+    # Summary statistics are aggregated as results arrive, per subfolder:
+    # [parse time, Rust time, Python time, sum of speedups, files, compared files]
+    by_subfolder = defaultdict(lambda: [0.0, 0.0, 0.0, 0.0, 0, 0])
+    top_speedups = []  # min-heap of (speedup, completed, file, subfolder)
     
-    with ProcessPoolExecutor(max_workers=NUM_WORKERS) as executor:
-        # Submit all jobs
-        future_to_file = {
-            executor.submit(process_single_file, filepath, structures_dir): filepath 
-            for filepath in structure_files
-        }
-        
-        for future in as_completed(future_to_file):
+    # fork lets workers inherit the imported modules; spawn is the only safe option elsewhere
+    mp_context = mp.get_context("fork" if sys.platform.startswith("linux") else "spawn")
+    chunk_size = max(1, min(total // (NUM_WORKERS * 4), CHUNK_MAX_FILES))
+    # Files are dealt round-robin so every chunk gets a share of the largest
+    # ones, instead of the first chunk holding all of them back to back
+    num_chunks = -(-total // chunk_size)
+    chunks = (structure_files[i::num_chunks] for i in range(num_chunks))
+
+    # Results are collected by this process only; each CSV row is a single
+    # unbuffered write to an O_APPEND descriptor, so no lock or flush is needed.
+    # The Arrow file keeps typed columns and is the one to load for analysis.
+    summary_fd = None
+    arrow_writer = None
+    try:
+        if not args.no_csv:
+            summary_fd = os.open(summary_file,
+                                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND | getattr(os, "O_BINARY", 0),
+                                 0o644)
+            os.write(summary_fd, (",".join(csv_headers) + "\n").encode())
+        if HAS_PYARROW:
+            arrow_writer = ArrowRowWriter(arrow_file)
+
+        def write_row(row):
+            if summary_fd is not None:
+                os.write(summary_fd, to_csv_row(row))
+            if arrow_writer is not None:
+                arrow_writer.write(row)
+
+        worker_args = (structures_dir, WAVELENGTH, args.rust_only, args.count_only, args.batch)
+        if args.backend == "mpire":
+            results_iter = iter_results_mpire(chunks, NUM_WORKERS, worker_args, mp_context, cpu_ids)
+        else:
+            results_iter = iter_results_futures(chunks, NUM_WORKERS, worker_args, mp_context, cpu_ids,
+                                                share=args.shm)
+
+        for result in results_iter:
             completed += 1
-            result = future.result()
-            
+        
             if result[0] == 'success':
                 _, filepath, subfolder, row_data = result
-                
-                # Thread-safe CSV writing
-                with csv_lock:
-                    with open(summary_file, 'a', newline='') as f:
-                        writer = csv.DictWriter(f, fieldnames=csv_headers)
-                        writer.writerow(row_data)
-                
-                results.append(row_data)
-                
+                write_row(row_data)
+
+                stats = by_subfolder[subfolder]
+                stats[0] += row_data['time_parse_sec']
+                stats[1] += row_data['time_rust_sec']
+                stats[4] += 1
+                # Rows without a Python baseline have no speedup to report
+                speedup = row_data['speedup']
+                if speedup is not None:
+                    stats[2] += row_data['time_python_sec']
+                    stats[3] += speedup
+                    stats[5] += 1
+                    entry = (speedup, completed, filepath.name, subfolder)
+                    if len(top_speedups) < TOP_SPEEDUPS:
+                        heapq.heappush(top_speedups, entry)
+                    else:
+                        heapq.heappushpop(top_speedups, entry)
+            
                 print(f"[{completed}/{total}] {subfolder}/{filepath.name}")
-                print(f"  ✓ Rust: {row_data['time_rust_sec']}s ({row_data['peaks_rust']} peaks)")
-                print(f"  ✓ Python: {row_data['time_python_sec']}s ({row_data['peaks_python']} peaks)")
-                print(f"  → Speedup: {row_data['speedup']}x\n")
-                
+                print(f"  ✓ Parse: {row_data['time_parse_sec']:.4f}s")
+                print(f"  ✓ Rust: {row_data['time_rust_sec']:.4f}s ({row_data['peaks_rust']} peaks)")
+                if row_data['time_rust_kernel_sec'] is not None:
+                    print(f"    Rust kernel: {row_data['time_rust_kernel_sec']:.6f}s")
+                if speedup is not None:
+                    print(f"  ✓ Python: {row_data['time_python_sec']:.4f}s ({row_data['peaks_python']} peaks)")
+                    print(f"  → Speedup: {speedup:.2f}x")
+                print()
+            
             else: 
                 _, filepath, subfolder, error_row, error_msg = result
-                
+            
                 print(f"[{completed}/{total}] {subfolder}/{filepath.name}")
                 print(f"  ✗ ERROR: {error_msg}\n")
-                
-                with csv_lock:
-                    with open(summary_file, 'a', newline='') as f:
-                        writer = csv.DictWriter(f, fieldnames=csv_headers)
-                        writer.writerow(error_row)
+            
+                write_row(error_row)
+    finally:
+        if summary_fd is not None:
+            os.close(summary_fd)
+        if arrow_writer is not None:
+            arrow_writer.close()
 
     print(f"\n{'='*70}")
     print(f"BENCHMARK COMPLETE")
     print(f"{'='*70}")
-    print(f"\nTotal files processed: {len(results)}")
+    (total_time_parse, total_time_rust, total_time_python,
+     total_speedup, processed, compared) = [sum(column) for column in zip(*by_subfolder.values())] or [0] * 6
 
-    if results:
-        total_time_rust = sum(float(r['time_rust_sec']) for r in results)
-        total_time_python = sum(float(r['time_python_sec']) for r in results)
-        avg_speedup = sum(float(r['speedup']) for r in results) / len(results)
-        
+    print(f"\nTotal files processed: {processed}")
+
+    if processed:
         print(f"\nTotal calculation time:")
+        print(f"  Parse:  {total_time_parse:.2f}s")
         print(f"  Rust:   {total_time_rust:.2f}s")
+
+    if compared:
+        avg_speedup = total_speedup / compared
+        
         print(f"  Python: {total_time_python:.2f}s")
         print(f"  Average speedup: {avg_speedup:.1f}x")
         
-        sorted_by_speedup = sorted(results, key=lambda x: float(x['speedup']), reverse=True)
-        
-        print(f"\nTop 5 speedups:")
-        for i, r in enumerate(sorted_by_speedup[:5], 1):
-            print(f"  {i}. {r['file']} ({r['subfolder']}): {r['speedup']}x")
-        
-        from collections import defaultdict
-        by_subfolder = defaultdict(list)
-        for r in results:
-            by_subfolder[r['subfolder']].append(r)
+        print(f"\nTop {TOP_SPEEDUPS} speedups:")
+        for i, (speedup, _, file, subfolder) in enumerate(sorted(top_speedups, reverse=True), 1):
+            print(f"  {i}. {file} ({subfolder}): {speedup:.2f}x")
         
         print(f"\nResults by subfolder:")
-        for subfolder, items in sorted(by_subfolder.items()):
-            count = len(items)
-            avg_speedup_sub = sum(float(r['speedup']) for r in items) / count
-            print(f"  {subfolder}: {count} files, avg speedup: {avg_speedup_sub:.1f}x")
+        for subfolder, stats in sorted(by_subfolder.items()):
+            count = stats[5]
+            if count:
+                print(f"  {subfolder}: {count} files, avg speedup: {stats[3] / count:.1f}x")
 
     print(f"\n{'='*70}")
-    print(f"Results saved to: {summary_file}")
+    print(f"Results saved to: {', '.join(map(str, saved_files))}")
     print(f"{'='*70}\n")
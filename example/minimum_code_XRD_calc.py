@@ -6,9 +6,9 @@ structure = Structure.from_file("structure.cif")
 calc = XRDCalculatorRust(wavelength="CuKa")
 pattern = calc.get_pattern(structure, scaled=False, two_theta_range=(5, 70))
 
-# Save to file
+# Save to file (rows are built lazily and written in one call)
+hkls = (str([tuple(h['hkl']) for h in group]) for group in pattern.hkls)
+rows = (f"{x},{y},{hkl}\n" for x, y, hkl in zip(pattern.x.tolist(), pattern.y.tolist(), hkls))
 with open("xrd_pattern.csv", 'w') as f:
     f.write("2theta,intensity,hkl\n")
-    for i in range(len(pattern.x)):
-        hkl = str([tuple(h['hkl']) for h in pattern.hkls[i]])
-        f.write(f"{pattern.x[i]},{pattern.y[i]},{hkl}\n")
+    f.writelines(rows)
@@ -18,7 +18,10 @@ try:
         get_unique_families_rust,
         generate_hkl_points,
         calculate_xrd_intensities,
+        calculate_xrd_intensities_timed,
+        calculate_xrd_intensities_batch,
         merge_peaks,
+        count_merged_peaks,
         normalize_intensities,
     )
     HAS_RUST = True
@@ -90,6 +93,132 @@ class XRDCalculatorRust(AbstractDiffractionPatternCalculator):
             )
 
     def get_pattern(self, structure: Structure, scaled=True, two_theta_range=(0, 90)):
+        return self._build_pattern(
+            *self._get_peaks(structure, two_theta_range), scaled=scaled
+        )
+
+    def get_pattern_timed(self, structure: Structure, scaled=True, two_theta_range=(0, 90)):
+        """Same as get_pattern, also returning the Rust kernel time in nanoseconds.
+
+        The time is measured inside Rust around the intensity calculation
+        only, excluding the Python-side preparation and PyO3 conversions.
+        """
+        intensity_input, d_hkls_list, is_hex = self._get_intensity_input(
+            structure, two_theta_range
+        )
+
+        two_thetas, intensities, kernel_ns = calculate_xrd_intensities_timed(
+            intensity_input,
+            wavelength=self.wavelength,
+            parallel=self.parallel,
+            num_threads=self.num_threads,
+            use_simd=self.use_simd,
+        )
+
+        peaks = self._select_peaks(
+            two_thetas, intensities, intensity_input["hkls"], d_hkls_list, is_hex
+        )
+        return self._build_pattern(*peaks, scaled=scaled), kernel_ns
+
+    def get_patterns_batch(self, structures, scaled=True, two_theta_range=(0, 90),
+                           return_exceptions=False):
+        """Calculate the patterns of several structures with a single Rust call.
+
+        With return_exceptions=True, a structure that fails is returned as
+        its exception in place of its pattern instead of failing the batch.
+        """
+        results = [None] * len(structures)
+        prepared = []
+        for index, structure in enumerate(structures):
+            try:
+                prepared.append((index, self._get_intensity_input(structure, two_theta_range)))
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results[index] = e
+
+        batch_results = calculate_xrd_intensities_batch(
+            [intensity_input for _, (intensity_input, _, _) in prepared],
+            wavelength=self.wavelength,
+            parallel=self.parallel,
+            num_threads=self.num_threads,
+            use_simd=self.use_simd,
+        )
+
+        for (index, (intensity_input, d_hkls_list, is_hex)), (two_thetas, intensities) in zip(
+            prepared, batch_results
+        ):
+            try:
+                results[index] = self._build_pattern(
+                    *self._select_peaks(
+                        two_thetas, intensities, intensity_input["hkls"], d_hkls_list, is_hex
+                    ),
+                    scaled=scaled,
+                )
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results[index] = e
+        return results
+
+    def get_pattern_count(self, structure: Structure, two_theta_range=(0, 90)) -> int:
+        """Number of peaks get_pattern would return, without assembling the pattern."""
+        two_thetas = self._get_peaks(structure, two_theta_range)[0]
+        return count_merged_peaks(two_thetas.tolist(), self.TWO_THETA_TOL)
+
+    def _build_pattern(self, two_thetas, intensities, hkls_int, d_hkls_final, scaled=True):
+        if len(two_thetas) > 0:
+            merged_data = merge_peaks(
+                two_thetas.tolist(),
+                intensities.tolist(),
+                hkls_int,
+                d_hkls_final.tolist(),
+                self.TWO_THETA_TOL,
+            )
+            two_thetas, intensities, hkls_groups, d_hkls_final = merged_data
+
+            formatted_hkls = []
+            for hkl_group in hkls_groups:
+                hkl_tuples = [h for h in hkl_group]
+                families = get_unique_families_rust(hkl_tuples)
+                formatted = [
+                    {"hkl": tuple(hkl), "multiplicity": mult}
+                    for hkl, mult in families.items()
+                ]
+                formatted_hkls.append(formatted)
+        else:
+            formatted_hkls = []
+
+        xrd = DiffractionPattern(
+            two_thetas,
+            intensities,
+            formatted_hkls,
+            d_hkls_final.tolist(),
+        )
+
+        if scaled and len(intensities) > 0:
+            xrd.normalize(mode="max", value=100)
+
+        return xrd
+
+    def _get_peaks(self, structure: Structure, two_theta_range):
+        intensity_input, d_hkls_list, is_hex = self._get_intensity_input(
+            structure, two_theta_range
+        )
+
+        two_thetas, intensities = calculate_xrd_intensities(
+            **intensity_input,
+            wavelength=self.wavelength,
+            parallel=self.parallel,
+            num_threads=self.num_threads,
+            use_simd=self.use_simd,
+        )
+
+        return self._select_peaks(
+            two_thetas, intensities, intensity_input["hkls"], d_hkls_list, is_hex
+        )
+
+    def _get_intensity_input(self, structure: Structure, two_theta_range):
         if self.symprec:
             finder = SpacegroupAnalyzer(structure, symprec=self.symprec)
             structure = finder.get_refined_structure()
@@ -142,69 +271,31 @@ class XRDCalculatorRust(AbstractDiffractionPatternCalculator):
             g_hkls.append(float(g_hkl))
             d_hkls_list.append(1.0 / g_hkl if g_hkl != 0 else 0.0)
 
-        results = calculate_xrd_intensities(
-            hkls=hkls,
-            g_hkls=g_hkls,
-            wavelength=wavelength,
-            frac_coords_x=_frac_coords_x,
-            frac_coords_y=_frac_coords_y,
-            frac_coords_z=_frac_coords_z,
-            atomic_numbers=_zs,
-            scattering_coeffs=_coeffs,
-            occupancies=_occus,
-            dw_factors=_dw_factors,
-            parallel=self.parallel,
-            num_threads=self.num_threads,
-            use_simd=self.use_simd,
-        )
-
-        two_thetas = []
-        intensities = []
-        hkls_int = []
-        d_hkls_final = []
-
-        for idx, (two_theta, intensity) in enumerate(results):
-            if intensity > self.SCALED_INTENSITY_TOL:
-                hkl = [int(h) for h in hkls[idx]]
-
-                if is_hex:
-                    hkl = [hkl[0], hkl[1], -hkl[0] - hkl[1], hkl[2]]
-
-                two_thetas.append(two_theta)
-                intensities.append(intensity)
-                hkls_int.append(hkl)
-                d_hkls_final.append(d_hkls_list[idx])
-
-        if len(two_thetas) > 0:
-            merged_data = merge_peaks(
-                two_thetas,
-                intensities,
-                hkls_int,
-                d_hkls_final,
-                self.TWO_THETA_TOL,
-            )
-            two_thetas, intensities, hkls_groups, d_hkls_final = merged_data
+        intensity_input = {
+            "hkls": hkls,
+            "g_hkls": g_hkls,
+            "frac_coords_x": _frac_coords_x,
+            "frac_coords_y": _frac_coords_y,
+            "frac_coords_z": _frac_coords_z,
+            "atomic_numbers": _zs,
+            "scattering_coeffs": _coeffs,
+            "occupancies": _occus,
+            "dw_factors": _dw_factors,
+        }
 
-            formatted_hkls = []
-            for hkl_group in hkls_groups:
-                hkl_tuples = [h for h in hkl_group]
-                families = get_unique_families_rust(hkl_tuples)
-                formatted = [
-                    {"hkl": tuple(hkl), "multiplicity": mult}
-                    for hkl, mult in families.items()
-                ]
-                formatted_hkls.append(formatted)
-        else:
-            formatted_hkls = []
+        return intensity_input, d_hkls_list, is_hex
 
-        xrd = DiffractionPattern(
-            list(two_thetas),
-            list(intensities),
-            formatted_hkls,
-            list(d_hkls_final),
-        )
+    def _select_peaks(self, two_thetas, intensities, hkls, d_hkls_list, is_hex):
+        keep = np.flatnonzero(intensities > self.SCALED_INTENSITY_TOL)
 
-        if scaled and len(intensities) > 0:
-            xrd.normalize(mode="max", value=100)
+        hkls_int = np.asarray(hkls, dtype=int).reshape(-1, 3)[keep]
+        if is_hex:
+            h, k, l = hkls_int.T
+            hkls_int = np.column_stack((h, k, -h - k, l))
 
-        return xrd
\ No newline at end of file
+        return (
+            two_thetas[keep],
+            intensities[keep],
+            hkls_int.tolist(),
+            np.asarray(d_hkls_list)[keep],
+        )
\ No newline at end of file
@@ -2,7 +2,9 @@ use pyo3::prelude::*;
 use pyo3::types::{PyDict, PyTuple};
 use std::collections::HashMap;
 use std::f64::consts::PI;
+use std::time::Instant;
 use rayon::prelude::*;
+use numpy::{IntoPyArray, PyArray1};
 use wide::f64x4;
 
 #[inline]
@@ -199,11 +201,11 @@ fn calculate_structure_factor_simd_soa(
     (real, imag)
 }
 
-#[pyfunction]
-fn calculate_xrd_intensities(
+#[derive(FromPyObject)]
+#[pyo3(from_item_all)]
+struct IntensityInput {
     hkls: Vec<Vec<f64>>,
     g_hkls: Vec<f64>,
-    wavelength: f64,
     frac_coords_x: Vec<f64>,
     frac_coords_y: Vec<f64>,
     frac_coords_z: Vec<f64>,
@@ -211,121 +213,275 @@ fn calculate_xrd_intensities(
     scattering_coeffs: Vec<Vec<Vec<f64>>>,
     occupancies: Vec<f64>,
     dw_factors: Vec<f64>,
-    parallel: bool,
-    num_threads: usize,
-    use_simd: bool,
-) -> PyResult<Vec<(f64, f64)>> {
-
-    let frac_coords_x     = std::sync::Arc::new(frac_coords_x);
-    let frac_coords_y     = std::sync::Arc::new(frac_coords_y);
-    let frac_coords_z     = std::sync::Arc::new(frac_coords_z);
-    let atomic_numbers    = std::sync::Arc::new(atomic_numbers);
-    let scattering_coeffs = std::sync::Arc::new(scattering_coeffs);
-    let occupancies       = std::sync::Arc::new(occupancies);
-    let dw_factors        = std::sync::Arc::new(dw_factors);
-    let g_hkls            = std::sync::Arc::new(g_hkls);
-
-    let compute = {
-        let frac_coords_x     = std::sync::Arc::clone(&frac_coords_x);
-        let frac_coords_y     = std::sync::Arc::clone(&frac_coords_y);
-        let frac_coords_z     = std::sync::Arc::clone(&frac_coords_z);
-        let atomic_numbers    = std::sync::Arc::clone(&atomic_numbers);
-        let scattering_coeffs = std::sync::Arc::clone(&scattering_coeffs);
-        let occupancies       = std::sync::Arc::clone(&occupancies);
-        let dw_factors        = std::sync::Arc::clone(&dw_factors);
-        let g_hkls            = std::sync::Arc::clone(&g_hkls);
-
-        move |idx: usize, hkl: &Vec<f64>| -> (f64, f64) {
-            let g_hkl = g_hkls[idx];
-            if g_hkl == 0.0 { return (0.0, 0.0); }
-
-            let sin_theta = wavelength * g_hkl / 2.0;
-            if sin_theta > 1.0 { return (0.0, 0.0); }
-
-            let theta     = sin_theta.asin();
-            let s         = g_hkl / 2.0;
-            let s_squared = s * s;
-
-            let mut scattering_factors = Vec::with_capacity(atomic_numbers.len());
-            for i in 0..atomic_numbers.len() {
-                let coeffs: Vec<[f64; 2]> = scattering_coeffs[i]
-                    .iter()
-                    .map(|c| [c[0], c[1]])
-                    .collect();
-                scattering_factors.push(
-                    calculate_scattering_factor(atomic_numbers[i], s_squared, &coeffs)
-                );
-            }
+}
+
+/// Scattering coefficients converted once per structure and deduplicated
+/// per species, so each hkl evaluates f(s) once per distinct species
+/// instead of rebuilding the coefficient table for every atom.
+struct ScatteringTable {
+    atomic_numbers: Vec<i32>,
+    coeffs: Vec<Vec<[f64; 2]>>,
+    dw_factors: Vec<f64>,
+    species_index: Vec<usize>,
+}
 
-            let dw_corrections: Vec<f64> = dw_factors
+impl ScatteringTable {
+    fn new(input: &IntensityInput) -> Self {
+        let mut lookup: HashMap<(i32, Vec<u64>, u64), usize> = HashMap::new();
+        let mut atomic_numbers = Vec::new();
+        let mut coeffs_table   = Vec::new();
+        let mut dw_factors     = Vec::new();
+        let mut species_index  = Vec::with_capacity(input.atomic_numbers.len());
+
+        for i in 0..input.atomic_numbers.len() {
+            let coeffs: Vec<[f64; 2]> = input.scattering_coeffs[i]
                 .iter()
-                .map(|&dw| (-dw * s_squared).exp())
+                .map(|c| [c[0], c[1]])
                 .collect();
+            let key = (
+                input.atomic_numbers[i],
+                coeffs.iter().flat_map(|c| [c[0].to_bits(), c[1].to_bits()]).collect::<Vec<u64>>(),
+                input.dw_factors[i].to_bits(),
+            );
+            let idx = *lookup.entry(key).or_insert_with(|| {
+                atomic_numbers.push(input.atomic_numbers[i]);
+                coeffs_table.push(coeffs);
+                dw_factors.push(input.dw_factors[i]);
+                atomic_numbers.len() - 1
+            });
+            species_index.push(idx);
+        }
 
-            let (real, imag) = if use_simd {
-                calculate_structure_factor_simd_soa(
-                    hkl,
-                    &frac_coords_x,
-                    &frac_coords_y,
-                    &frac_coords_z,
-                    &scattering_factors,
-                    &occupancies,
-                    &dw_corrections,
-                )
-            } else {
-                calculate_structure_factor_scalar_soa(
-                    hkl,
-                    &frac_coords_x,
-                    &frac_coords_y,
-                    &frac_coords_z,
-                    &scattering_factors,
-                    &occupancies,
-                    &dw_corrections,
-                )
-            };
-
-            let intensity      = real * real + imag * imag;
-            let cos_theta      = theta.cos();
-            let sin_theta_sq   = theta.sin().powi(2);
-            let two_theta      = 2.0 * theta;
-            let lorentz_factor = (1.0 + two_theta.cos().powi(2))
-                               / (sin_theta_sq * cos_theta);
-
-            (two_theta.to_degrees(), intensity * lorentz_factor)
+        ScatteringTable {
+            atomic_numbers,
+            coeffs: coeffs_table,
+            dw_factors,
+            species_index,
         }
+    }
+
+    /// Per-atom scattering factors and Debye-Waller corrections at s².
+    fn evaluate(&self, s_squared: f64) -> (Vec<f64>, Vec<f64>) {
+        let species_factors: Vec<f64> = self.atomic_numbers
+            .iter()
+            .zip(&self.coeffs)
+            .map(|(&z, coeffs)| calculate_scattering_factor(z, s_squared, coeffs))
+            .collect();
+        let species_dw: Vec<f64> = self.dw_factors
+            .iter()
+            .map(|&dw| (-dw * s_squared).exp())
+            .collect();
+
+        let scattering_factors = self.species_index.iter().map(|&k| species_factors[k]).collect();
+        let dw_corrections     = self.species_index.iter().map(|&k| species_dw[k]).collect();
+        (scattering_factors, dw_corrections)
+    }
+}
+
+fn calculate_intensity(
+    input: &IntensityInput,
+    table: &ScatteringTable,
+    idx: usize,
+    wavelength: f64,
+    use_simd: bool,
+) -> (f64, f64) {
+    let hkl   = &input.hkls[idx];
+    let g_hkl = input.g_hkls[idx];
+    if g_hkl == 0.0 { return (0.0, 0.0); }
+
+    let sin_theta = wavelength * g_hkl / 2.0;
+    if sin_theta > 1.0 { return (0.0, 0.0); }
+
+    let theta     = sin_theta.asin();
+    let s         = g_hkl / 2.0;
+    let s_squared = s * s;
+
+    let (scattering_factors, dw_corrections) = table.evaluate(s_squared);
+
+    let (real, imag) = if use_simd {
+        calculate_structure_factor_simd_soa(
+            hkl,
+            &input.frac_coords_x,
+            &input.frac_coords_y,
+            &input.frac_coords_z,
+            &scattering_factors,
+            &input.occupancies,
+            &dw_corrections,
+        )
+    } else {
+        calculate_structure_factor_scalar_soa(
+            hkl,
+            &input.frac_coords_x,
+            &input.frac_coords_y,
+            &input.frac_coords_z,
+            &scattering_factors,
+            &input.occupancies,
+            &dw_corrections,
+        )
     };
 
-    let results: Vec<(f64, f64)> = if parallel {
-        let pool = rayon::ThreadPoolBuilder::new()
-            .num_threads(num_threads)
-            .build()
-            .unwrap();
+    let intensity      = real * real + imag * imag;
+    let cos_theta      = theta.cos();
+    let sin_theta_sq   = theta.sin().powi(2);
+    let two_theta      = 2.0 * theta;
+    let lorentz_factor = (1.0 + two_theta.cos().powi(2))
+                       / (sin_theta_sq * cos_theta);
+
+    (two_theta.to_degrees(), intensity * lorentz_factor)
+}
+
+fn calculate_intensities_serial(
+    input: &IntensityInput,
+    wavelength: f64,
+    use_simd: bool,
+) -> Vec<(f64, f64)> {
+    let table = ScatteringTable::new(input);
+    (0..input.hkls.len())
+        .map(|idx| calculate_intensity(input, &table, idx, wavelength, use_simd))
+        .collect()
+}
+
+fn build_thread_pool(num_threads: usize) -> rayon::ThreadPool {
+    rayon::ThreadPoolBuilder::new()
+        .num_threads(num_threads)
+        .build()
+        .unwrap()
+}
+
+fn calculate_intensities(
+    input: &IntensityInput,
+    wavelength: f64,
+    parallel: bool,
+    num_threads: usize,
+    use_simd: bool,
+) -> Vec<(f64, f64)> {
+    if parallel {
+        let table = ScatteringTable::new(input);
+        let pool  = build_thread_pool(num_threads);
         pool.install(|| {
-            hkls.par_iter()
-                .enumerate()
-                .map(|(idx, hkl)| compute(idx, hkl))
+            (0..input.hkls.len())
+                .into_par_iter()
+                .map(|idx| calculate_intensity(input, &table, idx, wavelength, use_simd))
                 .collect()
         })
     } else {
-        hkls.iter()
-            .enumerate()
-            .map(|(idx, hkl)| compute(idx, hkl))
-            .collect()
+        calculate_intensities_serial(input, wavelength, use_simd)
+    }
+}
+
+type ArrayPair<'py> = (Bound<'py, PyArray1<f64>>, Bound<'py, PyArray1<f64>>);
+
+fn into_arrays(py: Python<'_>, results: Vec<(f64, f64)>) -> ArrayPair<'_> {
+    let (two_thetas, intensities): (Vec<f64>, Vec<f64>) = results.into_iter().unzip();
+    (two_thetas.into_pyarray(py), intensities.into_pyarray(py))
+}
+
+#[pyfunction]
+fn calculate_xrd_intensities(
+    py: Python<'_>,
+    hkls: Vec<Vec<f64>>,
+    g_hkls: Vec<f64>,
+    wavelength: f64,
+    frac_coords_x: Vec<f64>,
+    frac_coords_y: Vec<f64>,
+    frac_coords_z: Vec<f64>,
+    atomic_numbers: Vec<i32>,
+    scattering_coeffs: Vec<Vec<Vec<f64>>>,
+    occupancies: Vec<f64>,
+    dw_factors: Vec<f64>,
+    parallel: bool,
+    num_threads: usize,
+    use_simd: bool,
+) -> PyResult<ArrayPair<'_>> {
+    let input = IntensityInput {
+        hkls,
+        g_hkls,
+        frac_coords_x,
+        frac_coords_y,
+        frac_coords_z,
+        atomic_numbers,
+        scattering_coeffs,
+        occupancies,
+        dw_factors,
     };
 
-    Ok(results)
+    let results = py.allow_threads(|| {
+        calculate_intensities(&input, wavelength, parallel, num_threads, use_simd)
+    });
+    Ok(into_arrays(py, results))
+}
+
+#[pyfunction]
+fn calculate_xrd_intensities_timed(
+    py: Python<'_>,
+    input: IntensityInput,
+    wavelength: f64,
+    parallel: bool,
+    num_threads: usize,
+    use_simd: bool,
+) -> PyResult<(Bound<'_, PyArray1<f64>>, Bound<'_, PyArray1<f64>>, u64)> {
+    // Started after PyO3 has converted the arguments and stopped before the
+    // GIL is reacquired, so only the kernel is timed
+    let (results, elapsed) = py.allow_threads(|| {
+        let start   = Instant::now();
+        let results = calculate_intensities(&input, wavelength, parallel, num_threads, use_simd);
+        (results, start.elapsed().as_nanos() as u64)
+    });
+
+    let (two_thetas, intensities) = into_arrays(py, results);
+    Ok((two_thetas, intensities, elapsed))
+}
+
+#[pyfunction]
+fn calculate_xrd_intensities_batch(
+    py: Python<'_>,
+    inputs: Vec<IntensityInput>,
+    wavelength: f64,
+    parallel: bool,
+    num_threads: usize,
+    use_simd: bool,
+) -> PyResult<Vec<ArrayPair<'_>>> {
+    // One thread pool for the whole batch; structures are distributed
+    // across threads instead of the hkl points of a single structure.
+    let results: Vec<Vec<(f64, f64)>> = py.allow_threads(|| {
+        if parallel {
+            let pool = build_thread_pool(num_threads);
+            pool.install(|| {
+                inputs.par_iter()
+                    .map(|input| calculate_intensities_serial(input, wavelength, use_simd))
+                    .collect()
+            })
+        } else {
+            inputs.iter()
+                .map(|input| calculate_intensities_serial(input, wavelength, use_simd))
+                .collect()
+        }
+    });
+
+    Ok(results.into_iter().map(|r| into_arrays(py, r)).collect())
 }
 
 #[pyfunction]
 fn merge_peaks(
+    py: Python<'_>,
     two_thetas: Vec<f64>,
     intensities: Vec<f64>,
     hkls: Vec<Vec<i32>>,
     d_hkls: Vec<f64>,
     tolerance: f64,
-) -> PyResult<(Vec<f64>, Vec<f64>, Vec<Vec<Vec<i32>>>, Vec<f64>)> {
+) -> PyResult<(
+    Bound<'_, PyArray1<f64>>,
+    Bound<'_, PyArray1<f64>>,
+    Vec<Vec<Vec<i32>>>,
+    Bound<'_, PyArray1<f64>>,
+)> {
     if two_thetas.is_empty() {
-        return Ok((vec![], vec![], vec![], vec![]));
+        return Ok((
+            Vec::<f64>::new().into_pyarray(py),
+            Vec::<f64>::new().into_pyarray(py),
+            vec![],
+            Vec::<f64>::new().into_pyarray(py),
+        ));
     }
 
     let mut merged_thetas      = Vec::new();
@@ -359,7 +515,31 @@ fn merge_peaks(
     merged_hkls.push(current_hkls);
     merged_d_hkls.push(current_d);
 
-    Ok((merged_thetas, merged_intensities, merged_hkls, merged_d_hkls))
+    Ok((
+        merged_thetas.into_pyarray(py),
+        merged_intensities.into_pyarray(py),
+        merged_hkls,
+        merged_d_hkls.into_pyarray(py),
+    ))
+}
+
+#[pyfunction]
+fn count_merged_peaks(two_thetas: Vec<f64>, tolerance: f64) -> PyResult<usize> {
+    if two_thetas.is_empty() {
+        return Ok(0);
+    }
+
+    let mut count         = 1;
+    let mut current_theta = two_thetas[0];
+
+    for &theta in &two_thetas[1..] {
+        if (theta - current_theta).abs() >= tolerance {
+            count += 1;
+            current_theta = theta;
+        }
+    }
+
+    Ok(count)
 }
 
 #[pyfunction]
@@ -382,7 +562,10 @@ fn xrd_rust_accelerator(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(get_unique_families_rust, m)?)?;
     m.add_function(wrap_pyfunction!(generate_hkl_points, m)?)?;
     m.add_function(wrap_pyfunction!(calculate_xrd_intensities, m)?)?;
+    m.add_function(wrap_pyfunction!(calculate_xrd_intensities_timed, m)?)?;
+    m.add_function(wrap_pyfunction!(calculate_xrd_intensities_batch, m)?)?;
     m.add_function(wrap_pyfunction!(merge_peaks, m)?)?;
+    m.add_function(wrap_pyfunction!(count_merged_peaks, m)?)?;
     m.add_function(wrap_pyfunction!(normalize_intensities, m)?)?;
     Ok(())
 }
\ No newline at end of file